@@ -7,241 +7,817 @@ Reads PDF files and converts them to Markdown format
 import fitz  # PyMuPDF
 import sys
 import os
+import importlib.util
+import re
+import shutil
+import subprocess
+import tempfile
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
 from PIL import Image
-import io
+from tqdm import tqdm
+
+# tesserocr keeps the Tesseract model loaded in-process instead of starting a
+# tesseract subprocess for every batch. It is only imported inside OCR worker
+# processes (see _get_tess_api), after _init_ocr_worker has limited OpenMP;
+# workers fall back to the tesseract CLI if it turns out not to load
+TESSEROCR_AVAILABLE = importlib.util.find_spec("tesserocr") is not None
+
+# Try to import numpy: with tesserocr, OCR pages are rendered into one shared
+# memory slab per batch instead of TIFF files
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
 
 # Try to import pytesseract, but make it optional
 try:
     import pytesseract
     OCR_AVAILABLE = True
 except ImportError:
-    OCR_AVAILABLE = False
+    pytesseract = None
+    OCR_AVAILABLE = TESSEROCR_AVAILABLE
+if not OCR_AVAILABLE:
     print("Warning: pytesseract not installed. OCR functionality will be disabled.")
     print("Install with: pip install pytesseract")
     print("Also install Tesseract OCR: brew install tesseract (macOS) or apt-get install tesseract-ocr (Linux)")
 
+# Hand OCR pages to tesserocr as raw pixel arrays, skipping image files
+OCR_IN_MEMORY = TESSEROCR_AVAILABLE and NUMPY_AVAILABLE
+
+
+# Per-process tesserocr API, created lazily by _get_tess_api; False once
+# tesserocr has failed to load in this process
+_tess_api = None
+
+# Most pages per tesseract CLI run: the model is loaded once per run, so
+# larger batches amortize it. Short documents are split into one batch per
+# worker instead (see iter_pages)
+OCR_BATCH_PAGES = 32
+
+# Pages sampled up front to pick a text-native, scanned or mixed strategy
+PROBE_PAGES = 3
+
+# Minimum characters a sampled page needs to count as text-native
+NATIVE_MIN_CHARS = 20
+
+# Pages per shared-memory slab when OCR_IN_MEMORY is set; tesserocr workers
+# keep their model loaded, so small slabs (~3 MB a page) cost nothing extra
+# and spread evenly over the workers
+OCR_SLAB_PAGES = 8
+
+# Cap on the shared-memory slabs alive at once, whatever the core count.
+# /dev/shm is a tmpfs (64 MB by default in Docker), and running out of it
+# while pages are written kills the process with SIGBUS, not an exception
+OCR_SLAB_BYTES = 32 << 20
+
+# OCR batches queued per worker: one running and one ready to start, so the
+# pool stays busy while the next batch is rendered. Bounds the pages held
+# in memory or on disk
+OCR_QUEUE_PER_WORKER = 2
+
+# Page rasterization zoom for OCR (1.0 = 72 DPI)
+OCR_ZOOM = 2.5
 
-def extract_text_with_ocr(page, page_num):
+# Gray level above which a pixel becomes white when binarizing for OCR
+OCR_THRESHOLD = 180
+
+# Lines matching this are image metadata, not page text
+_IMG_META_RE = re.compile(r"^(?:<?image:|.*(?:ICCBased|width:|height:))")
+
+
+def _filter_lines(lines):
     """
-    Extract text from a PDF page using OCR
-    
+    Strip lines and drop empty and image metadata lines
+
+    Args:
+        lines: Iterable of text lines
+
+    Returns:
+        List of cleaned lines
+    """
+    return [s for s in (line.strip() for line in lines) if s and not _IMG_META_RE.match(s)]
+
+
+def _render_page_pixmap(page):
+    """
+    Rasterize a PDF page to a grayscale pixmap for OCR
+
     Args:
         page: PyMuPDF page object
-        page_num: Page number (for progress indication)
-    
+
     Returns:
-        Extracted text string
+        Single-channel fitz.Pixmap
+    """
+    # Grayscale at 2.5x zoom (~180 DPI): Tesseract's cost is dominated by pixel
+    # count, and one channel is a third of the bytes of RGB
+    mat = fitz.Matrix(OCR_ZOOM, OCR_ZOOM)
+    return page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+
+
+def _save_page_tiff(pix, tiff_path):
+    """
+    Binarize a page pixmap and save it as a compressed TIFF for Tesseract
+
+    Args:
+        pix: Grayscale pixmap from _render_page_pixmap
+        tiff_path: Path of the TIFF file to write
+    """
+    # Wrap the raw pixel buffer directly - no PNG encode/decode round-trip
+    _save_gray_tiff(Image.frombytes("L", (pix.width, pix.height), pix.samples), tiff_path)
+
+
+def _save_gray_tiff(gray, tiff_path):
+    """
+    Binarize a grayscale image and save it as a compressed TIFF for Tesseract
+
+    Args:
+        gray: PIL image in mode "L" (closed by this function)
+        tiff_path: Path of the TIFF file to write
     """
-    if not OCR_AVAILABLE:
-        return ""
-    
     try:
-        # Convert PDF page to image
-        # Use higher DPI for better OCR accuracy (300 DPI recommended)
-        mat = fitz.Matrix(2.0, 2.0)  # 2x zoom = ~144 DPI, increase for better quality
-        pix = page.get_pixmap(matrix=mat)
-        
-        # Convert to PIL Image
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
-        
-        # Perform OCR with Korean and English language support
-        # You can add more languages: 'kor+eng+jpn' for Korean, English, Japanese
-        try:
-            text = pytesseract.image_to_string(img, lang='kor+eng')
-        except:
-            # Fallback to English only if Korean language pack not installed
-            text = pytesseract.image_to_string(img, lang='eng')
-        
-        return text.strip()
-    except Exception as e:
-        print(f"  Warning: OCR failed for page {page_num}: {e}")
-        return ""
+        # Binarize up front so Tesseract can skip its own thresholding pass
+        img = gray.point(lambda p: 255 if p > OCR_THRESHOLD else 0, mode="1")
+    finally:
+        gray.close()
+
+    try:
+        img.save(tiff_path, format="TIFF", compression="group4", dpi=(72 * OCR_ZOOM, 72 * OCR_ZOOM))
+    finally:
+        img.close()
 
 
-def extract_text_from_pdf(pdf_path, use_ocr=False):
+def _new_ocr_batch(pix, pages, slab_bytes):
     """
-    Extract text from PDF file page by page with improved extraction methods
+    Start an OCR batch for pages of the same size as pix
+
+    With OCR_IN_MEMORY the batch owns a shared-memory slab of as many rows of
+    the pixmap's size as slab_bytes allows, up to `pages`; workers attach to
+    it by name instead of receiving pickled pixels. Otherwise, or when no
+    slab can be had, the batch collects TIFF files.
 
     Args:
-        pdf_path: Path to the PDF file
-        use_ocr: Whether to use OCR for image-based PDFs (default: auto-detect)
+        pix: Grayscale pixmap of the batch's first page
+        pages: Maximum number of pages in the batch
+        slab_bytes: Maximum size of the batch's slab
 
     Returns:
-        List of tuples (page_number, text_content)
+        Tuple (page_nums, images, shm). With a slab, images is its (rows,
+        height, width) and shm its SharedMemory; otherwise images is a list
+        of TIFF paths and shm is None.
     """
-    doc = fitz.open(pdf_path)
-    pages_content = []
-    ocr_used = False
-
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        
-        # Method 1: Try standard text extraction
-        text = page.get_text("text")
-        
-        # Filter out image metadata (common pattern: <image: ...>)
-        if text.strip():
-            lines = text.split("\n")
-            filtered_lines = []
-            for line in lines:
-                line_stripped = line.strip()
-                # Skip image metadata lines
-                if line_stripped.startswith("<image:") or line_stripped.startswith("image:"):
-                    continue
-                # Skip lines that look like image metadata
-                if "ICCBased" in line_stripped or "width:" in line_stripped or "height:" in line_stripped:
-                    continue
-                if line_stripped:
-                    filtered_lines.append(line_stripped)
-            text = "\n".join(filtered_lines)
-        
-        # Method 2: If empty, try blocks method (preserves layout better)
-        if not text.strip():
-            blocks = page.get_text("blocks")
-            text_parts = []
-            for block in blocks:
-                if len(block) >= 5:  # block format: (x0, y0, x1, y1, "text", ...)
-                    block_text = block[4].strip()
-                    # Filter out image metadata
-                    if block_text and not block_text.startswith("<image:") and "ICCBased" not in block_text:
-                        text_parts.append(block_text)
-            text = "\n".join(text_parts)
-        
-        # Method 3: If still empty, try dict method (most comprehensive)
-        if not text.strip():
-            text_dict = page.get_text("dict")
-            text_parts = []
-            for block in text_dict.get("blocks", []):
-                if "lines" in block:
-                    for line in block["lines"]:
-                        line_text = " ".join(
-                            span.get("text", "") 
-                            for span in line.get("spans", [])
-                        )
-                        line_text = line_text.strip()
-                        # Filter out image metadata
-                        if line_text and not line_text.startswith("<image:") and "ICCBased" not in line_text:
-                            text_parts.append(line_text)
-            text = "\n".join(text_parts)
-        
-        # Method 4: Try rawdict for complex layouts
-        if not text.strip():
+    if OCR_IN_MEMORY:
+        page_bytes = pix.height * pix.width
+        rows = min(pages, slab_bytes // page_bytes)
+        # SharedMemory does not reserve its pages, so check /dev/shm has room
+        # for them up front rather than die of SIGBUS while filling the slab
+        if rows and not (
+            os.path.isdir("/dev/shm")
+            and shutil.disk_usage("/dev/shm").free < rows * page_bytes
+        ):
             try:
-                raw_dict = page.get_text("rawdict")
-                text_parts = []
-                for block in raw_dict.get("blocks", []):
-                    if "lines" in block:
-                        for line in block["lines"]:
-                            line_text = " ".join(
-                                span.get("text", "") 
-                                for span in line.get("spans", [])
-                            )
-                            line_text = line_text.strip()
-                            # Filter out image metadata
-                            if line_text and not line_text.startswith("<image:") and "ICCBased" not in line_text:
-                                text_parts.append(line_text)
-                text = "\n".join(text_parts)
-            except:
+                shm = SharedMemory(create=True, size=rows * page_bytes)
+            except OSError:
                 pass
-        
-        # Method 5: If still no text and OCR is available, use OCR
-        if not text.strip() and OCR_AVAILABLE:
-            if use_ocr or page_num == 0:  # Auto-detect: try OCR on first page if no text
-                if page_num % 10 == 0:  # Progress indicator every 10 pages
-                    print(f"  Processing page {page_num + 1} with OCR...")
-                ocr_text = extract_text_with_ocr(page, page_num + 1)
-                if ocr_text:
-                    text = ocr_text
-                    ocr_used = True
-                    # If OCR worked on first page, enable it for all pages
-                    if page_num == 0:
-                        use_ocr = True
-        
-        pages_content.append((page_num + 1, text))
-
-    doc.close()
-    
-    if ocr_used:
-        print(f"  OCR was used to extract text from image-based pages")
-    
-    return pages_content
+            else:
+                return [], (rows, pix.height, pix.width), shm
+    return [], [], None
+
+
+def _ocr_batch_fits(batch, pix):
+    """Whether a page pixmap can join the batch (slab rows share one size)"""
+    _, images, shm = batch
+    return shm is None or images[1:] == (pix.height, pix.width)
+
+
+def _ocr_batch_full(batch, pages):
+    """Whether a batch has no room left (a slab holds its own row count)"""
+    page_nums, images, shm = batch
+    return len(page_nums) >= (images[0] if shm is not None else pages)
+
+
+def _slab_bytes(ready, in_flight):
+    """Total size of the shared-memory slabs of ready and queued OCR batches"""
+    batches = ready + [batch for _, batch in in_flight]
+    return sum(shm.size for _, _, shm in batches if shm is not None)
+
+
+def _add_ocr_page(batch, pix, page_num, work_dir):
+    """
+    Add a rendered page to an OCR batch
+
+    Args:
+        batch: Batch from _new_ocr_batch that pix fits
+        pix: Grayscale pixmap from _render_page_pixmap
+        page_num: Page number (used in the image file name)
+        work_dir: Directory for temporary page images
+    """
+    page_nums, images, shm = batch
+    if shm is not None:
+        _, height, width = images
+        row = np.ndarray(
+            (height, width), dtype=np.uint8, buffer=shm.buf,
+            offset=len(page_nums) * height * width
+        )
+        gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(height, pix.stride)
+        # Binarize straight into the slab row - 0/1 in place, then 0/255 - so
+        # Tesseract can skip its own thresholding pass
+        np.greater(gray[:, :width], OCR_THRESHOLD, out=row.view(np.bool_))
+        row *= 255
+    else:
+        tiff_path = os.path.join(work_dir, f"page_{page_num:05d}.tif")
+        _save_page_tiff(pix, tiff_path)
+        images.append(tiff_path)
+    page_nums.append(page_num)
+
+
+def _release_ocr_batch(batch):
+    """Free the shared slab or delete the TIFF files of an OCR batch"""
+    _, images, shm = batch
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+    else:
+        for tiff_path in images:
+            os.remove(tiff_path)
+
+
+def _init_ocr_worker():
+    """Limit Tesseract to a single thread inside each OCR worker process"""
+    # Set in the worker only, before tesserocr loads OpenMP: more processes x 1
+    # thread beats fewer processes x N threads for Tesseract
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _get_tess_api():
+    """
+    Return this process's tesserocr API, creating it on first use
+
+    Each OCR worker process gets its own API, so the model is loaded once per
+    worker and reused for every page it handles.
+
+    Returns:
+        PyTessBaseAPI instance, or None if tesserocr cannot be loaded
+    """
+    global _tess_api
+    if _tess_api is None:
+        try:
+            from tesserocr import PyTessBaseAPI, OEM
+
+            # Perform OCR with Korean and English language support
+            try:
+                _tess_api = PyTessBaseAPI(lang='kor+eng', oem=OEM.LSTM_ONLY)
+            except RuntimeError:
+                # Fallback to English only if Korean language pack not installed
+                _tess_api = PyTessBaseAPI(lang='eng', oem=OEM.LSTM_ONLY)
+        except (ImportError, RuntimeError):
+            # Installed but unusable (e.g. libtesseract missing): callers
+            # fall back to the tesseract CLI
+            _tess_api = False
+    return _tess_api or None
+
+
+def _clean_ocr_text(text):
+    """Remove excessive whitespace but preserve paragraph structure"""
+    return "\n".join(s for s in (line.strip() for line in text.split("\n")) if s)
+
+
+def _ocr_tiff_batch(tiff_paths, out_base):
+    """
+    OCR a batch of page images, loading the Tesseract model only once
+
+    Uses the in-process tesserocr API when it loads. Otherwise Tesseract
+    reads a newline-delimited list of images and writes every page to one
+    file separated by form feeds. Safe to run in a worker process.
+
+    Args:
+        tiff_paths: Paths to single-page TIFF images
+        out_base: Output path without extension (Tesseract appends .txt)
+
+    Returns:
+        List of extracted text strings, one per image
+    """
+    api = _get_tess_api() if TESSEROCR_AVAILABLE else None
+    if api is not None:
+        page_texts = []
+        for tiff_path in tiff_paths:
+            api.SetImageFile(tiff_path)
+            page_texts.append(_clean_ocr_text(api.GetUTF8Text()))
+        return page_texts
+
+    list_path = out_base + "_images.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(tiff_paths) + "\n")
+
+    # More processes x 1 thread beats fewer processes x N threads for Tesseract
+    env = {**os.environ, "OMP_THREAD_LIMIT": "1"}
+    tesseract_cmd = pytesseract.pytesseract.tesseract_cmd if pytesseract else "tesseract"
+
+    # Perform OCR with Korean and English language support
+    # You can add more languages: 'kor+eng+jpn' for Korean, English, Japanese
+    result = subprocess.run(
+        [tesseract_cmd, list_path, out_base, "-l", "kor+eng", "--oem", "1"],
+        env=env, capture_output=True
+    )
+    if result.returncode != 0:
+        # Fallback to English only if Korean language pack not installed
+        subprocess.run(
+            [tesseract_cmd, list_path, out_base, "-l", "eng", "--oem", "1"],
+            env=env, capture_output=True, check=True
+        )
+
+    with open(out_base + ".txt", encoding='utf-8') as f:
+        page_texts = f.read().split("\f")
+
+    return [
+        _clean_ocr_text(page_texts[i]) if i < len(page_texts) else ""
+        for i in range(len(tiff_paths))
+    ]
+
+
+def _ocr_slab_batch(shm_name, shape, out_base):
+    """
+    OCR pages stored in a shared-memory slab through the tesserocr API
+
+    Runs in a worker process, which attaches to the slab the parent rendered
+    into; no pixels cross the process boundary. If tesserocr cannot be
+    loaded, the pages are written out as TIFFs for the tesseract CLI.
+
+    Args:
+        shm_name: Name of the SharedMemory block holding the slab
+        shape: (pages, height, width) of the filled part of the slab
+        out_base: Output path without extension for the tesseract CLI
+
+    Returns:
+        List of extracted text strings, one per page
+    """
+    shm = SharedMemory(name=shm_name)
+    try:
+        api = _get_tess_api()
+        pages, height, width = shape
+        page_size = height * width
+        page_texts = []
+        tiff_paths = []
+        for i in range(pages):
+            # SetImageBytes only accepts bytes, so each page is copied once here
+            page_bytes = bytes(shm.buf[i * page_size:(i + 1) * page_size])
+            if api is None:
+                tiff_paths.append(f"{out_base}_{i:03d}.tif")
+                _save_gray_tiff(Image.frombytes("L", (width, height), page_bytes), tiff_paths[-1])
+                continue
+            api.SetImageBytes(page_bytes, width, height, 1, width)
+            api.SetSourceResolution(int(72 * OCR_ZOOM))
+            page_texts.append(_clean_ocr_text(api.GetUTF8Text()))
+    finally:
+        shm.close()
+
+    if tiff_paths:
+        try:
+            page_texts = _ocr_tiff_batch(tiff_paths, out_base)
+        finally:
+            for tiff_path in tiff_paths:
+                os.remove(tiff_path)
+    return page_texts
+
 
+def _ocr_page_batch(tiff_paths, out_base, slab=None):
+    """
+    OCR a batch of rendered pages in whichever form they were rendered
+
+    Runs in a worker process.
+
+    Args:
+        tiff_paths: Paths to single-page TIFF images (empty with a slab)
+        out_base: Output path without extension for the tesseract CLI
+        slab: (shared memory name, shape) of a slab holding the pages
 
-def convert_to_markdown(pages_content, pdf_filename):
+    Returns:
+        List of extracted text strings, one per page
     """
-    Convert extracted PDF content to Markdown format
+    if slab is not None:
+        return _ocr_slab_batch(*slab, out_base)
+    return _ocr_tiff_batch(tiff_paths, out_base)
+
+
+def _extract_text_native(page):
+    """
+    Extract page text with a single blocks pass
+
+    One content-stream walk returns text together with its layout.
 
     Args:
-        pages_content: List of tuples (page_number, text_content)
-        pdf_filename: Name of the source PDF file
+        page: PyMuPDF page object
 
     Returns:
-        Markdown formatted string
+        Cleaned text string
     """
-    markdown_lines = []
+    blocks = page.get_text("blocks")  # block format: (x0, y0, x1, y1, "text", ...)
+    return "\n".join(_filter_lines(
+        line for block in blocks if len(block) >= 5 for line in block[4].split("\n")
+    ))
 
-    # Add title
-    markdown_lines.append(f"# {pdf_filename}\n")
-    markdown_lines.append("---\n")
 
-    # Add content page by page
-    for page_num, text in pages_content:
-        markdown_lines.append(f"\n## Page {page_num}\n")
+def _extract_text_rawdict(page):
+    """
+    Extract page text from rawdict, for CJK-heavy pages where blocks under-segments
 
-        # Clean up and format text
-        if text.strip():
-            # Remove excessive whitespace but preserve paragraph structure
-            cleaned_text = "\n".join(
-                line.strip() for line in text.split("\n") if line.strip()
+    Args:
+        page: PyMuPDF page object
+
+    Returns:
+        Cleaned text string
+    """
+    try:
+        raw_dict = page.get_text("rawdict")
+        # rawdict spans carry per-character entries, not "text"
+        line_texts = (
+            " ".join(
+                "".join(char.get("c", "") for char in span.get("chars", []))
+                for span in line.get("spans", [])
             )
-            markdown_lines.append(cleaned_text)
-        else:
-            markdown_lines.append("*[No text content on this page - may be image-based PDF]*")
+            for block in raw_dict.get("blocks", [])
+            for line in block.get("lines", [])
+        )
+        return "\n".join(_filter_lines(line_texts))
+    except:
+        return ""
+
+
+def _extract_text(page):
+    """
+    Extract page text with the blocks pass, falling back to rawdict
+
+    Args:
+        page: PyMuPDF page object
+
+    Returns:
+        Cleaned text string
+    """
+    return _extract_text_native(page) or _extract_text_rawdict(page)
+
+
+def _has_images(page):
+    """
+    Whether a page draws any image, including inline images
+
+    get_images only lists image XObjects, which misses scans embedded as
+    inline images; get_image_info walks the page content and sees both.
+
+    Args:
+        page: PyMuPDF page object
+
+    Returns:
+        True if the page contains an image
+    """
+    return bool(page.get_image_info())
+
+
+def _probe_document(doc):
+    """
+    Sample the first pages to decide how the whole document is extracted
+
+    Args:
+        doc: Open fitz.Document
+
+    Returns:
+        Tuple (strategy, probe_texts). strategy is "native" when every sampled
+        page has a text layer, "scanned" when no sampled page has text but
+        some carry images, and "mixed" otherwise. probe_texts holds the blocks
+        text of the sampled pages so they are not extracted twice.
+    """
+    probe_texts = [
+        _extract_text_native(doc[page_num])
+        for page_num in range(min(PROBE_PAGES, len(doc)))
+    ]
+
+    if probe_texts and all(len(text) >= NATIVE_MIN_CHARS for text in probe_texts):
+        return "native", probe_texts
+    # Blank pages are common in scanned books, so one image page is enough
+    if not any(probe_texts) and any(
+        _has_images(doc[page_num]) for page_num in range(len(probe_texts))
+    ):
+        return "scanned", probe_texts
+    return "mixed", probe_texts
+
+
+def _submit_ocr_batch(executor, batch, work_dir):
+    """
+    Queue an OCR batch on the worker pool
+
+    Args:
+        executor: ProcessPoolExecutor running the OCR batches
+        batch: Batch from _new_ocr_batch
+        work_dir: Directory for Tesseract list and output files
+
+    Returns:
+        Future of the batch's list of page texts
+    """
+    page_nums, images, shm = batch
+    out_base = os.path.join(work_dir, f"batch_{page_nums[0]:05d}")
+    if shm is None:
+        return executor.submit(_ocr_page_batch, images, out_base)
+    # Only the slab's name and filled shape are pickled
+    slab = (shm.name, (len(page_nums),) + images[1:])
+    return executor.submit(_ocr_page_batch, [], out_base, slab)
+
+
+def _run_ocr_batch_alone(batch, work_dir):
+    """
+    OCR a batch in a fresh single-worker pool
+
+    Used after a worker died: every batch queued on its pool fails with
+    BrokenProcessPool, and rerunning them one at a time isolates the batch
+    that actually kills its worker.
+
+    Args:
+        batch: Batch from _new_ocr_batch
+        work_dir: Directory for Tesseract list and output files
+
+    Returns:
+        List of extracted text strings, one per page
+    """
+    with ProcessPoolExecutor(max_workers=1, initializer=_init_ocr_worker) as solo:
+        return _submit_ocr_batch(solo, batch, work_dir).result()
+
+
+def _collect_ocr_batch(future, batch, texts, work_dir):
+    """
+    Wait for an OCR batch, store its text and release its page images
+
+    Args:
+        future: Future from _submit_ocr_batch
+        batch: The submitted batch
+        texts: Dict of page number -> text content to update
+        work_dir: Directory for Tesseract list and output files
+
+    Returns:
+        True if OCR produced text for any page
+    """
+    page_nums = batch[0]
+    try:
+        try:
+            ocr_texts = future.result()
+        except BrokenProcessPool:
+            ocr_texts = _run_ocr_batch_alone(batch, work_dir)
+    except Exception as e:
+        print(f"  Warning: OCR failed for pages {page_nums[0]}-{page_nums[-1]}: {e}")
+        ocr_texts = []
+    finally:
+        _release_ocr_batch(batch)
+
+    ocr_used = False
+    for page_num, ocr_text in zip(page_nums, ocr_texts):
+        if ocr_text:
+            texts[page_num] = ocr_text
+            ocr_used = True
+    return ocr_used
+
 
-        markdown_lines.append("\n")
+def iter_pages(pdf_path, use_ocr=False):
+    """
+    Extract text from PDF file page by page with improved extraction methods
 
-    return "\n".join(markdown_lines)
+    Pages are yielded in order as soon as they are ready. OCR pages are
+    rendered into batches that the worker pool recognizes while later pages
+    are still being rendered; a page is held back only until the batches up
+    to it are done, and the queue is bounded per worker, so memory stays
+    bounded rather than growing with the document length.
+
+    Args:
+        pdf_path: Path to the PDF file, or an open fitz.Document (left open)
+        use_ocr: Whether to use OCR for image-based PDFs (default: auto-detect)
+
+    Yields:
+        Tuples (page_number, text_content)
+    """
+    if not isinstance(pdf_path, fitz.Document):
+        with fitz.open(pdf_path) as doc:
+            yield from iter_pages(doc, use_ocr=use_ocr)
+        return
+
+    doc = pdf_path
+    pending = deque()  # Page numbers not yet yielded, in page order
+    texts = {}  # Page number -> text content
+    batch = None  # OCR batch being filled
+    ready = []  # Filled OCR batches to submit
+    in_flight = deque()  # Tuples (future, batch) in page order
+    ocr_used = False
+    work_dir = None
+    executor = None
+
+    try:
+        # Specialize once per document: sample the first pages and bind a
+        # single extraction path for the whole page loop
+        strategy, probe_texts = _probe_document(doc)
+        if strategy == "native" and not use_ocr:
+            # Text layer everywhere: blocks pass only, no fallbacks or OCR
+            extract_page = _extract_text_native
+            ocr_enabled = False
+        elif strategy == "scanned" and OCR_AVAILABLE:
+            # No text layer in the sample: take the cheap blocks pass, so
+            # later born-digital pages keep their text, and OCR the rest
+            extract_page = _extract_text_native
+            ocr_enabled = True
+        else:
+            # Mixed documents are only OCR'd on request
+            extract_page = _extract_text
+            ocr_enabled = OCR_AVAILABLE and use_ocr
+            probe_texts = [
+                text or _extract_text_rawdict(doc[page_num])
+                for page_num, text in enumerate(probe_texts)
+            ]
+
+        workers = os.cpu_count() or 1
+        if sys.platform == "win32":
+            # ProcessPoolExecutor rejects more than 61 workers on Windows
+            workers = min(workers, 61)
+        # Short documents still get a batch per worker: a full-size batch
+        # would put a 32-page scan on one single-threaded Tesseract
+        batch_pages = max(1, min(
+            OCR_SLAB_PAGES if OCR_IN_MEMORY else OCR_BATCH_PAGES,
+            -(-len(doc) // workers)
+        ))
+
+        # tqdm throttles terminal updates, so progress costs nothing per page
+        progress = tqdm(
+            range(len(doc)), desc="  Pages", unit="page",
+            disable=not sys.stderr.isatty()
+        )
+        for page_num in progress:
+            page = doc[page_num]
+            
+            if page_num < len(probe_texts):
+                text = probe_texts[page_num]
+            else:
+                text = extract_page(page)
+            
+            pending.append(page_num + 1)
+            texts[page_num + 1] = text
+
+            # If there is no text and OCR is enabled, use OCR
+            # Pages are rendered here (fitz.Document is not fork-safe) and
+            # recognized in batches by a process pool.
+            # Extracted text is already stripped line by line, so emptiness
+            # needs no further strip() copy of the page, and blank pages
+            # have no embedded images - skip rasterizing them
+            if not text and ocr_enabled and _has_images(page):
+                if work_dir is None:
+                    work_dir = tempfile.TemporaryDirectory()
+                try:
+                    pix = _render_page_pixmap(page)
+                    # Slab rows share one page size: a page of another size
+                    # starts a new batch instead of padding every row
+                    if batch is not None and not _ocr_batch_fits(batch, pix):
+                        ready.append(batch)
+                        batch = None
+                    if batch is None:
+                        slab_bytes = 0
+                        if OCR_IN_MEMORY:
+                            # Split OCR_SLAB_BYTES over the workers, and wait
+                            # for queued slabs rather than go over it
+                            page_bytes = pix.height * pix.width
+                            slab_bytes = page_bytes * min(
+                                batch_pages,
+                                max(1, OCR_SLAB_BYTES // (workers * page_bytes))
+                            )
+                            while in_flight and (
+                                _slab_bytes(ready, in_flight) + slab_bytes > OCR_SLAB_BYTES
+                            ):
+                                ocr_used = _collect_ocr_batch(
+                                    *in_flight.popleft(), texts, work_dir.name
+                                ) or ocr_used
+                            slab_bytes = min(
+                                slab_bytes, OCR_SLAB_BYTES - _slab_bytes(ready, in_flight)
+                            )
+                        batch = _new_ocr_batch(pix, batch_pages, slab_bytes)
+                    _add_ocr_page(batch, pix, page_num + 1, work_dir.name)
+                except Exception as e:
+                    print(f"  Warning: OCR failed for page {page_num + 1}: {e}")
+                    if batch is not None and not batch[0]:
+                        _release_ocr_batch(batch)
+                        batch = None
+                finally:
+                    # Release the MuPDF pixmap now instead of when the next page reassigns it
+                    pix = None
+
+            if batch is not None and (
+                _ocr_batch_full(batch, batch_pages) or page_num == len(doc) - 1
+            ):
+                ready.append(batch)
+                batch = None
+
+            while ready:
+                if executor is None:
+                    executor = ProcessPoolExecutor(
+                        max_workers=workers, initializer=_init_ocr_worker
+                    )
+                try:
+                    future = _submit_ocr_batch(executor, ready[0], work_dir.name)
+                except BrokenProcessPool:
+                    # A worker died (out of memory, or a crash inside
+                    # Tesseract) and its pool takes no more work. Batches
+                    # already queued on it are retried by _collect_ocr_batch
+                    executor.shutdown(wait=False)
+                    executor = None
+                    continue
+                in_flight.append((future, ready.pop(0)))
+
+            # Keep OCR_QUEUE_PER_WORKER batches queued per worker so rendering
+            # overlaps recognition; collect finished batches in page order
+            while in_flight and (
+                len(in_flight) > workers * OCR_QUEUE_PER_WORKER or in_flight[0][0].done()
+            ):
+                ocr_used = _collect_ocr_batch(
+                    *in_flight.popleft(), texts, work_dir.name
+                ) or ocr_used
+
+            # Yield every page ahead of the first one still waiting on OCR
+            waiting = in_flight[0][1] if in_flight else batch
+            while pending and (waiting is None or pending[0] < waiting[0][0]):
+                page_no = pending.popleft()
+                yield page_no, texts.pop(page_no)
+
+        while in_flight:
+            ocr_used = _collect_ocr_batch(
+                *in_flight.popleft(), texts, work_dir.name
+            ) or ocr_used
+        for page_no in pending:
+            yield page_no, texts[page_no]
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        for _, leftover in in_flight:
+            _release_ocr_batch(leftover)
+        for leftover in ready + ([batch] if batch is not None else []):
+            _release_ocr_batch(leftover)
+        if work_dir is not None:
+            work_dir.cleanup()
+    
+    if ocr_used:
+        print(f"  OCR was used to extract text from image-based pages")
 
 
 def pdf_to_markdown(pdf_path, output_path=None, use_ocr=False):
     """
     Convert PDF file to Markdown
 
+    Pages are written to the output file as they are extracted, so the whole
+    document is never held in memory. They go to a ".part" file next to the
+    output that replaces it only once conversion succeeds, so a failure never
+    leaves a truncated file or clobbers an earlier good one.
+
     Args:
         pdf_path: Path to input PDF file
         output_path: Path to output Markdown file (optional)
         use_ocr: Force OCR usage even if text extraction works (default: auto-detect)
     """
-    # Validate input file
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+    pdf_path = Path(pdf_path)
 
-    if not pdf_path.lower().endswith('.pdf'):
+    # Validate input file
+    if pdf_path.suffix.lower() != '.pdf':
         raise ValueError("Input file must be a PDF")
 
     # Determine output path
     if output_path is None:
-        output_path = Path(pdf_path).stem + ".md"
+        output_path = pdf_path.stem + ".md"
 
-    print(f"Reading PDF: {pdf_path}")
+    # fitz.open performs the existence check itself - no separate stat call
+    try:
+        doc = fitz.open(pdf_path)
+    except fitz.FileNotFoundError:
+        raise FileNotFoundError(f"PDF file not found: {pdf_path}") from None
 
-    # Extract text from PDF
-    pages_content = extract_text_from_pdf(pdf_path, use_ocr=use_ocr)
-    print(f"Extracted {len(pages_content)} pages")
-    
-    # Count pages with text
-    pages_with_text = sum(1 for _, text in pages_content if text.strip())
-    print(f"Pages with text: {pages_with_text}/{len(pages_content)}")
+    print(f"Reading PDF: {pdf_path}")
 
-    # Convert to Markdown
-    markdown_content = convert_to_markdown(pages_content, Path(pdf_path).name)
+    page_count = 0
+    pages_with_text = 0
 
-    # Write output file
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(markdown_content)
+    part_path = f"{output_path}.part"
 
+    # Extract text from PDF and write Markdown page by page
+    try:
+        with doc, open(part_path, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            # Add title
+            f.write(f"# {pdf_path.name}\n\n---\n")
+
+            for page_num, text in iter_pages(doc, use_ocr=use_ocr):
+                f.write(f"\n\n## Page {page_num}\n\n")
+                f.write(text if text else "*[No text content on this page - may be image-based PDF]*")
+                f.write("\n\n")
+                page_count += 1
+                pages_with_text += bool(text)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.replace(part_path, output_path)
+
+    print(f"Extracted {page_count} pages")
+    print(f"Pages with text: {pages_with_text}/{page_count}")
     print(f"Markdown file created: {output_path}")
     
     if pages_with_text == 0 and not OCR_AVAILABLE: